@@ -1,11 +1,21 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from docx import Document
 from docx.shared import Pt, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from io import BytesIO
+from matplotlib.figure import Figure
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import bisect
+import hashlib
+import heapq
+import re
+import threading
+import unicodedata
 import time
 import uuid
 import datetime
@@ -38,6 +48,17 @@ SCHEMA = {
     'FinalReviews': ['Email', 'Dot', 'NhanXet_CuoiKy', 'PhanHoi_PH', 'TrangThai_CuoiKy']
 }
 
+# Kiểu dữ liệu theo cột (cột không liệt kê giữ dạng chuỗi, ô trống = "")
+COL_TYPES = {'SiSo': int, 'MucTieuSo': float, 'ThucDat': float, 'TienDo': float, 'DiemHaiLong_PH': float}
+
+# Các sheet mỗi view cần -> tải song song 1 lần khi vào view
+VIEW_SHEETS = {
+    'Admin': ['Periods', 'Users', 'OKRs', 'FinalReviews'],
+    'GiaoVien': ['Periods', 'Users', 'OKRs', 'FinalReviews'],
+    'HocSinh': ['Periods', 'OKRs', 'FinalReviews'],
+    'PhuHuynh': ['Periods', 'OKRs', 'FinalReviews']
+}
+
 if 'user' not in st.session_state:
     st.session_state.user = None
 
@@ -55,11 +76,39 @@ def get_client():
         st.error(f"🔴 Lỗi kết nối Google API: {e}")
         return None
 
+LOAD_TTL = 600
+
+@st.cache_resource
+def _loaded_at():
+    """Thời điểm load_data thực sự tải từng sheet (để prefetch bỏ qua sheet đã có trong cache)"""
+    return {}
+
 # FIX: Tăng TTL lên 600s (10 phút) để tránh lỗi Quota Exceeded
-@st.cache_data(ttl=600)
+# Spinner hiển thị 1 lần ở prefetch_data (luồng chính), không vẽ từ các thread tải song song
+@st.cache_data(ttl=LOAD_TTL, show_spinner=False)
 def load_data(sheet_name):
+    df = _fetch_sheet(sheet_name)
+    # Đánh dấu cả khi lỗi: kết quả lỗi cũng nằm trong cache, prefetch không cần gọi lại
+    stamp = time.time()
+    _loaded_at()[sheet_name] = stamp
+    df.attrs['loaded_at'] = stamp  # Phiên bản dữ liệu của frame (xem data_version)
+    return df
+
+def data_version(*frames):
+    """Phiên bản dữ liệu = thời điểm load_data tải từng frame (đổi khi cache hết hạn hoặc bị xóa sau khi ghi)"""
+    return tuple(df.attrs.get('loaded_at', 0.0) for df in frames)
+
+def _needs_build(store, version):
+    """
+    Bảng phụ cần build lại khi chưa build, hoặc dữ liệu truyền vào mới hơn dữ liệu đã build.
+    Phiên còn giữ frame cũ hơn không được build lùi lại bảng của phiên khác.
+    """
+    if not store['built_at']: return True
+    return version != store['version'] and all(v >= o for v, o in zip(version, store['version']))
+
+def _fetch_sheet(sheet_name):
     client = get_client()
-    if not client: return pd.DataFrame()
+    if not client: return pd.DataFrame(columns=SCHEMA[sheet_name])
     try:
         sh = client.open_by_key(SHEET_ID)
         try:
@@ -69,38 +118,68 @@ def load_data(sheet_name):
             ws.append_row(SCHEMA[sheet_name])
             return pd.DataFrame(columns=SCHEMA[sheet_name])
         
-        data = ws.get_all_records()
-        df = pd.DataFrame(data)
-        
-        # Auto-Schema Migration
-        expected_cols = SCHEMA[sheet_name]
-        if df.empty: return pd.DataFrame(columns=expected_cols)
-        
-        for col in expected_cols:
-            if col not in df.columns:
-                val = 0 if col in ['SiSo', 'MucTieuSo', 'ThucDat', 'TienDo', 'DiemHaiLong_PH'] else ""
-                df[col] = val
-        
-        # Reorder columns
-        df = df[[c for c in expected_cols if c in df.columns] + [c for c in df.columns if c not in expected_cols]]
-        
-        # Type Casting
-        if sheet_name == 'Users':
-            df['SiSo'] = pd.to_numeric(df['SiSo'], errors='coerce').fillna(0).astype(int)
-            df['Password'] = df['Password'].astype(str)
-            df['Lop'] = df['Lop'].astype(str)
-        if sheet_name == 'OKRs':
-            for c in ['MucTieuSo', 'ThucDat', 'TienDo', 'DiemHaiLong_PH']:
-                df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
-                
-        return df
+        # Lấy nguyên khối giá trị 2-D (không dựng dict từng dòng như get_all_records)
+        return frame_from_values(sheet_name, ws.get_all_values())
     except Exception as e:
         st.error(f"Lỗi tải dữ liệu {sheet_name}: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(columns=SCHEMA[sheet_name])
+
+def frame_from_values(sheet_name, values):
+    """
+    Dựng DataFrame từ khối giá trị 2-D theo SCHEMA: thêm cột thiếu, sắp thứ tự cột, ép kiểu số.
+    Ô số không hợp lệ được đặt = 0 và báo gộp 1 lần cho cả sheet.
+    """
+    expected_cols = SCHEMA[sheet_name]
+    if len(values) < 2: return pd.DataFrame(columns=expected_cols)
+
+    header = [str(h).strip() for h in values[0]]
+    df = pd.DataFrame(values[1:], columns=header)
+    df = df.loc[:, (df.columns != "") & ~df.columns.duplicated()]
+
+    # Auto-Schema Migration + Reorder columns
+    missing = {c: ("0" if c in COL_TYPES else "") for c in expected_cols if c not in df.columns}
+    if missing: df = df.assign(**missing)
+    df = df[expected_cols + [c for c in df.columns if c not in expected_cols]]
+
+    # Type Casting (vector hóa trên cả khối cột số)
+    num_cols = [c for c in df.columns if c in COL_TYPES]
+    if num_cols:
+        raw = df[num_cols]
+        num = raw.apply(pd.to_numeric, errors='coerce')
+        bad = num.isna() & raw.apply(lambda s: s.str.strip() != "")
+        if bad.values.any():
+            details = [f"{c} (dòng {', '.join(str(i + 2) for i in bad.index[bad[c]][:5])}{'...' if bad[c].sum() > 5 else ''})"
+                       for c in num_cols if bad[c].any()]
+            st.warning(f"⚠️ {sheet_name}: {int(bad.values.sum())} ô số không hợp lệ, tạm tính = 0: {'; '.join(details)}")
+        num = num.fillna(0)
+        df[num_cols] = num.astype({c: COL_TYPES[c] for c in num_cols})
+    return df
+
+def prefetch_data(*sheet_names):
+    """
+    Nạp song song (thread pool) vào cache của load_data các sheet CHƯA có trong cache.
+    Rerun khi cache còn hạn không tạo thread nào. Lỗi từng sheet được cô lập trong load_data.
+    """
+    loaded = _loaded_at()
+    now = time.time()
+    missing = [n for n in sheet_names if now - loaded.get(n, 0) >= LOAD_TTL]
+    if not missing: return
+    ctx = get_script_run_ctx()
+
+    def _load(name):
+        # Gắn context của phiên hiện tại để st.cache_data / st.error hoạt động trong thread
+        add_script_run_ctx(threading.current_thread(), ctx)
+        load_data(name)
+
+    with st.spinner("Đang tải dữ liệu..."):
+        with ThreadPoolExecutor(max_workers=len(missing)) as ex:
+            list(ex.map(_load, missing))
 
 def clear_cache():
-    """Xóa cache khi có hành động Ghi để tải lại dữ liệu mới nhất"""
-    st.cache_data.clear()
+    """Xóa cache khi có hành động Ghi để tải lại dữ liệu mới nhất.
+    Biểu đồ được cache theo hash dữ liệu nên không cần xóa."""
+    load_data.clear()
+    _loaded_at().clear()
 
 # --- SAFE FUNCTIONS (DIRECT GSPREAD MANIPULATION) ---
 
@@ -113,6 +192,7 @@ def safe_delete_user(email):
         if cell:
             ws.delete_rows(cell.row)
             clear_cache() # Quan trọng: Xóa cache sau khi ghi
+            search_mark_stale()
             return True
         return False
     except Exception as e:
@@ -134,6 +214,7 @@ def safe_update_user(email, col_name, new_val):
         if cell:
             ws.update_cell(cell.row, col_idx, new_val)
             clear_cache()
+            search_mark_stale()
             return True
         return False
     except Exception as e:
@@ -175,8 +256,300 @@ def safe_update_okr_progress(okr_id, new_actual, new_progress):
         st.error(f"Lỗi cập nhật tiến độ: {e}")
         return False
 
+# --- BULK PROGRESS RECOMPUTE (VECTORIZED, CHỈ GHI DÒNG THAY ĐỔI) ---
+
+PROGRESS_TOL = 1e-9  # So trên giá trị gốc (UNFORMATTED); chỉ bỏ qua sai số dấu phẩy động
+
+def recompute_progress(period=None):
+    """
+    Tính lại TienDo cho 1 đợt (hoặc cả sheet nếu period=None) từ ThucDat / MucTieuSo.
+    Đọc 1 lần, ghi 1 lần bằng batch_update chỉ cho các dòng thay đổi. Trả về số dòng đã sửa, None nếu lỗi.
+    Giá trị ghi không làm tròn, giống calculate_progress ở student_view.
+    """
+    try:
+        client = get_client()
+        ws = client.open_by_key(SHEET_ID).worksheet('OKRs')
+        # Đọc mới (không dùng cache để đúng vị trí dòng), lấy giá trị gốc thay vì giá trị đã định dạng hiển thị.
+        # Ngày giờ vẫn lấy dạng chuỗi hiển thị (không phải số serial) để Dot khớp tên đợt trong Periods
+        values = ws.get_all_values(value_render_option='UNFORMATTED_VALUE',
+                                   date_time_render_option='FORMATTED_STRING')
+        if len(values) < 2: return 0
+
+        headers = [str(h).strip() for h in values[0]]
+        try: cols = {c: headers.index(c) for c in ('Dot', 'MucTieuSo', 'ThucDat', 'TienDo')}
+        except ValueError:
+            st.error("Lỗi cấu trúc Sheet: Thiếu cột Dot/MucTieuSo/ThucDat/TienDo.")
+            return None
+
+        body = pd.DataFrame(values[1:])
+        df = pd.DataFrame({c: body[i] if i in body.columns else "" for c, i in cols.items()})
+        if period is not None: df = df[df['Dot'].astype(str) == str(period)]
+        new = np.nan_to_num(calculate_progress_vec(df['ThucDat'], df['MucTieuSo']), nan=0.0)
+        old = pd.to_numeric(df['TienDo'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+        changed = ~np.isclose(new, old, rtol=0, atol=PROGRESS_TOL)
+        rows = df.index[changed]  # index = vị trí dòng dữ liệu trong Sheet (dòng = index + 2)
+        col_tiendo = cols['TienDo'] + 1
+        if len(rows):
+            ws.batch_update([
+                {'range': gspread.utils.rowcol_to_a1(i + 2, col_tiendo), 'values': [[float(v)]]}
+                for i, v in zip(rows, new[changed])
+            ], value_input_option='USER_ENTERED')
+            clear_cache()
+        return len(rows)
+    except Exception as e:
+        st.error(f"Lỗi tính lại tiến độ: {e}")
+        return None
+
+# --- MATERIALIZED STATUS SUMMARY (KEY: Email, Dot) ---
+# Bảng trạng thái từng HS theo đợt, dùng chung cho mọi phiên.
+# CHỈ dùng cho số liệu hiển thị (thống kê, nhãn trạng thái), không dùng để quyết định giá trị ghi ngược lại Sheet.
+# Build từ OKRs + FinalReviews mỗi khi dữ liệu được tải lại (data_version đổi),
+# giữa 2 lần tải các hàm Ghi cập nhật tăng dần.
+
+@st.cache_resource
+def _status_store():
+    return {'rows': {}, 'built_at': 0.0, 'version': (), 'lock': threading.Lock()}
+
+def _empty_status():
+    return {'lop': "", 'n_okr': 0, 'n_approved': 0, 'rev': None}
+
+def _okr_part(df):
+    """{(Email, Dot): {lop, n_okr, n_approved}} tổng hợp bằng groupby"""
+    if df.empty: return {}
+    agg = (df.assign(_ok=(df['TrangThai'] == 'Đã duyệt'))
+             .groupby(['Email', 'Dot'], sort=False)
+             .agg(lop=('Lop', 'first'), n_okr=('_ok', 'size'), n_approved=('_ok', 'sum')))
+    return {k: {'lop': str(l), 'n_okr': int(n), 'n_approved': int(a)}
+            for k, l, n, a in zip(agg.index, agg['lop'], agg['n_okr'], agg['n_approved'])}
+
+def _rev_part(df):
+    """{(Email, Dot): TrangThai_CuoiKy} - lấy dòng đầu tiên như các view"""
+    if df.empty: return {}
+    d = df.drop_duplicates(['Email', 'Dot'])
+    return dict(zip(zip(d['Email'], d['Dot']), d['TrangThai_CuoiKy']))
+
+def ensure_status_table(df_okr, df_rev):
+    """Build bảng trạng thái nếu chưa có hoặc OKRs / FinalReviews vừa được tải lại"""
+    version = data_version(df_okr, df_rev)
+    store = _status_store()
+    with store['lock']:
+        if not _needs_build(store, version): return
+        rows = {}
+        for k, v in _okr_part(df_okr).items():
+            rows.setdefault(k, _empty_status()).update(v)
+        for k, v in _rev_part(df_rev).items():
+            rows.setdefault(k, _empty_status())['rev'] = v
+        store['rows'] = rows
+        store['built_at'] = time.time()
+        store['version'] = version
+
+def refresh_status(sheet_name, df):
+    """
+    Cập nhật bảng trạng thái sau khi ghi đè cả sheet (save_df).
+    Tự so sánh theo (Email, Dot): chỉ sửa các khóa có số liệu thay đổi, khóa không còn thì về 0.
+    """
+    if sheet_name not in ('OKRs', 'FinalReviews'): return
+    store = _status_store()
+    with store['lock']:
+        if not store['built_at']: return  # Chưa build -> lần đọc sau sẽ build đầy đủ
+        rows = store['rows']
+        if sheet_name == 'OKRs':
+            part = _okr_part(df)
+            for k in set(rows) | set(part):
+                new = part.get(k, {'n_okr': 0, 'n_approved': 0})
+                e = rows.setdefault(k, _empty_status())
+                if any(e[f] != v for f, v in new.items()): e.update(new)
+        else:
+            part = _rev_part(df)
+            for k in set(rows) | set(part):
+                e = rows.setdefault(k, _empty_status())
+                if e['rev'] != part.get(k): e['rev'] = part.get(k)
+
+def status_on_append(sheet_name, row_data):
+    """Cập nhật tăng dần khi thêm 1 dòng (append_row / batch_append)"""
+    if sheet_name not in ('OKRs', 'FinalReviews'): return
+    store = _status_store()
+    with store['lock']:
+        if not store['built_at']: return
+        if sheet_name == 'OKRs':
+            e = store['rows'].setdefault((row_data[1], row_data[3]), _empty_status())
+            e['lop'] = str(row_data[2])
+            e['n_okr'] += 1
+            e['n_approved'] += int(row_data[10] == 'Đã duyệt')
+        else:
+            e = store['rows'].setdefault((row_data[0], row_data[1]), _empty_status())
+            if e['rev'] is None: e['rev'] = row_data[4]
+
+def student_status(email, period):
+    """Trả về (icon, status_text) của 1 HS trong đợt"""
+    e = _status_store()['rows'].get((email, period)) or _empty_status()
+    if e['rev'] == 'Đã chốt': return "✅", "Đã chốt sổ"
+    if e['rev'] is not None: return "⏳", "Đang đánh giá"
+    if e['n_okr'] == 0: return "🔴", "Chưa nộp"
+    if e['n_approved'] == e['n_okr']: return "🟢", "Đã duyệt OKR"
+    return "🟡", "Chờ duyệt OKR"
+
+def class_status_counts(period):
+    """{Lop: (số HS đã nộp, số HS có OKR đã duyệt)} trong đợt"""
+    counts = {}
+    for (_, dot), e in list(_status_store()['rows'].items()):
+        if dot != period or e['n_okr'] == 0: continue
+        sub, app = counts.get(e['lop'], (0, 0))
+        counts[e['lop']] = (sub + 1, app + int(e['n_approved'] > 0))
+    return counts
+
+# --- SEARCH INDEX (INVERTED INDEX, TÌM CÓ DẤU / KHÔNG DẤU) ---
+# Mỗi KR (OKRs) và mỗi tổng kết (FinalReviews) là 1 tài liệu. Build lại mỗi khi dữ liệu được tải lại
+# (data_version đổi), giữa 2 lần tải các hàm Ghi cập nhật tăng dần (chỉ tokenize lại tài liệu có nội dung thay đổi).
+
+OKR_TEXT_COLS = ['MucTieu', 'KetQuaThenChot', 'NhanXet_GV', 'NhanXet_PH']
+REV_TEXT_COLS = ['NhanXet_CuoiKy', 'PhanHoi_PH']
+
+def fold_vn(text):
+    """Chữ thường + bỏ dấu tiếng Việt (đ -> d) để 'lo lắng' khớp 'lo lang'"""
+    s = unicodedata.normalize('NFD', str(text).lower()).replace('đ', 'd')
+    return ''.join(ch for ch in s if unicodedata.category(ch) != 'Mn')
+
+def tokenize(text):
+    return set(re.findall(r'\w+', fold_vn(text)))
+
+@st.cache_resource
+def _search_store():
+    return {'docs': {}, 'postings': {}, 'vocab': None, 'lop_of': {}, 'built_at': 0.0, 'version': (),
+            'lock': threading.Lock()}
+
+def _okr_doc(r):
+    meta = {'Loai': 'KR', 'Email': r['Email'], 'Lop': str(r['Lop']), 'Dot': r['Dot'], 'TrangThai': r['TrangThai']}
+    return ('OKR', str(r['ID'])), meta, tuple(str(r[c]) for c in OKR_TEXT_COLS)
+
+def _rev_doc(r, lop_of):
+    meta = {'Loai': 'Tổng kết', 'Email': r['Email'], 'Lop': lop_of.get(r['Email'], ""), 'Dot': r['Dot'],
+            'TrangThai': r['TrangThai_CuoiKy']}
+    return ('REV', r['Email'], r['Dot']), meta, tuple(str(r[c]) for c in REV_TEXT_COLS)
+
+def _sheet_docs(store, sheet_name, df):
+    """Sinh (doc_id, meta, texts) cho cả sheet; FinalReviews lấy dòng đầu mỗi (Email, Dot) như các view"""
+    if df.empty: return []
+    if sheet_name == 'OKRs': return [_okr_doc(r) for r in df.to_dict('records')]
+    d = df.drop_duplicates(['Email', 'Dot'])
+    return [_rev_doc(r, store['lop_of']) for r in d.to_dict('records')]
+
+def _unindex(store, doc_id):
+    doc = store['docs'].pop(doc_id, None)
+    if not doc: return
+    for tok in doc['tokens']:
+        ids = store['postings'].get(tok)
+        if ids is None: continue
+        ids.discard(doc_id)
+        if not ids:
+            del store['postings'][tok]
+            store['vocab'] = None
+
+def _index(store, doc_id, meta, texts):
+    _unindex(store, doc_id)
+    tokens = set().union(*(tokenize(t) for t in texts))
+    store['docs'][doc_id] = {'meta': meta, 'texts': texts, 'tokens': tokens}
+    for tok in tokens:
+        if tok not in store['postings']:
+            store['postings'][tok] = set()
+            store['vocab'] = None
+        store['postings'][tok].add(doc_id)
+
+def ensure_search_index(df_okr, df_rev, df_users):
+    """Build index nếu chưa có hoặc OKRs / FinalReviews / Users vừa được tải lại"""
+    version = data_version(df_okr, df_rev, df_users)
+    store = _search_store()
+    with store['lock']:
+        if not _needs_build(store, version): return
+        store.update(docs={}, postings={}, vocab=None)
+        hs = df_users[df_users['Role'] == 'HocSinh'] if not df_users.empty else df_users
+        store['lop_of'] = dict(zip(hs['Email'], hs['Lop'].astype(str))) if not hs.empty else {}
+        for sheet_name, df in (('OKRs', df_okr), ('FinalReviews', df_rev)):
+            for doc in _sheet_docs(store, sheet_name, df): _index(store, *doc)
+        store['built_at'] = time.time()
+        store['version'] = version
+
+def search_on_save(sheet_name, df):
+    """Sau save_df: chỉ index lại tài liệu có nội dung/trạng thái đổi, xóa tài liệu không còn"""
+    if sheet_name not in ('OKRs', 'FinalReviews'): return
+    store = _search_store()
+    with store['lock']:
+        if not store['built_at']: return
+        kind = 'OKR' if sheet_name == 'OKRs' else 'REV'
+        seen = set()
+        for doc_id, meta, texts in _sheet_docs(store, sheet_name, df):
+            seen.add(doc_id)
+            old = store['docs'].get(doc_id)
+            if old is None or old['texts'] != texts or old['meta'] != meta:
+                _index(store, doc_id, meta, texts)
+        for doc_id in [d for d in store['docs'] if d[0] == kind and d not in seen]:
+            _unindex(store, doc_id)
+
+def search_mark_stale():
+    """Users bị sửa / xóa (đổi Email, lớp...) -> build lại index ở lần tìm kiếm sau"""
+    store = _search_store()
+    with store['lock']: store['built_at'] = 0.0
+
+def search_on_append(sheet_name, row_data):
+    """Sau append_row / batch_append: index dòng mới, cập nhật lớp của HS mới thêm"""
+    if sheet_name not in ('OKRs', 'FinalReviews', 'Users'): return
+    store = _search_store()
+    with store['lock']:
+        if not store['built_at']: return
+        r = dict(zip(SCHEMA[sheet_name], row_data))
+        if sheet_name == 'Users':
+            if r['Role'] != 'HocSinh': return
+            lop = str(r['Lop'])
+            store['lop_of'][r['Email']] = lop
+            for doc_id, doc in store['docs'].items():
+                if doc_id[0] == 'REV' and doc_id[1] == r['Email']: doc['meta']['Lop'] = lop
+        elif sheet_name == 'OKRs': _index(store, *_okr_doc(r))
+        elif ('REV', r['Email'], r['Dot']) not in store['docs']: _index(store, *_rev_doc(r, store['lop_of']))
+
+def search_index(query, period=None, lop=None, status=None, limit=200):
+    """
+    Tìm các tài liệu chứa TẤT CẢ từ khóa (mỗi từ khớp theo tiền tố, không phân biệt dấu).
+    Trả về list {'meta', 'texts'} đã lọc theo đợt / lớp / trạng thái.
+    """
+    terms = tokenize(query)
+    if not terms: return []
+    store = _search_store()
+    with store['lock']:
+        if store['vocab'] is None: store['vocab'] = sorted(store['postings'])
+        vocab, postings = store['vocab'], store['postings']
+        result = None
+        for term in sorted(terms, key=len, reverse=True):
+            ids = set()
+            i = bisect.bisect_left(vocab, term)
+            while i < len(vocab) and vocab[i].startswith(term):
+                ids |= postings[vocab[i]]
+                i += 1
+            result = ids if result is None else result & ids
+            if not result: return []
+        hits = []
+        for doc_id in result:
+            doc = store['docs'][doc_id]
+            m = doc['meta']
+            if period and m['Dot'] != period: continue
+            if lop and m['Lop'] != lop: continue
+            if status and m['TrangThai'] != status: continue
+            hits.append({'meta': m, 'texts': doc['texts']})
+    # Chỉ cần `limit` kết quả đầu: chọn bằng heap thay vì sắp xếp toàn bộ
+    return heapq.nsmallest(limit, hits, key=lambda h: (str(h['meta']['Dot']), h['meta']['Lop'], h['meta']['Email']))
+
 # --- WRAPPER FUNCTIONS (ALWAYS CLEAR CACHE ON WRITE) ---
 
+def _after_write(hook, *args):
+    """
+    Cập nhật bảng phụ (status / search) sau khi đã ghi Sheet thành công.
+    Lỗi ở đây không được làm hỏng kết quả ghi: chỉ đánh dấu build lại ở lần đọc sau.
+    """
+    try:
+        hook(*args)
+    except Exception:
+        for store in (_status_store(), _search_store()):
+            with store['lock']: store['built_at'] = 0.0
+
 def save_df(sheet_name, df):
     try:
         client = get_client()
@@ -184,10 +557,12 @@ def save_df(sheet_name, df):
         ws.clear()
         ws.update([df.columns.values.tolist()] + df.values.tolist())
         clear_cache()
-        return True
     except Exception as e:
         st.error(f"Lỗi lưu dữ liệu: {e}")
         return False
+    _after_write(refresh_status, sheet_name, df)
+    _after_write(search_on_save, sheet_name, df)
+    return True
 
 def append_row(sheet_name, row_data):
     try:
@@ -200,10 +575,12 @@ def append_row(sheet_name, row_data):
             else: clean_row.append(str(x))
         ws.append_row(clean_row, value_input_option='USER_ENTERED')
         clear_cache()
-        return True
     except Exception as e:
         st.error(f"Lỗi thêm dữ liệu: {e}")
         return False
+    _after_write(status_on_append, sheet_name, row_data)
+    _after_write(search_on_append, sheet_name, row_data)
+    return True
 
 def batch_append(sheet_name, list_data):
     try:
@@ -211,10 +588,13 @@ def batch_append(sheet_name, list_data):
         ws = client.open_by_key(SHEET_ID).worksheet(sheet_name)
         ws.append_rows(list_data, value_input_option='USER_ENTERED')
         clear_cache()
-        return True
     except Exception as e:
         st.error(f"Lỗi import: {e}")
         return False
+    for r in list_data:
+        _after_write(status_on_append, sheet_name, r)
+        _after_write(search_on_append, sheet_name, r)
+    return True
 
 # =============================================================================
 # 3. UTILITIES & SIDEBAR
@@ -229,6 +609,15 @@ def calculate_progress(actual, target):
     except:
         return 0.0
 
+def calculate_progress_vec(actual, target):
+    """Bản vector hóa của calculate_progress (cùng xử lý target = 0 và giá trị không phải số)"""
+    a = pd.to_numeric(pd.Series(actual), errors='coerce').to_numpy(dtype=float)
+    t = pd.to_numeric(pd.Series(target), errors='coerce').to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prog = np.where(t == 0, np.where(a > 0, 100.0, 0.0), np.minimum(a / t * 100.0, 100.0))
+    prog[np.isnan(a) | np.isnan(t)] = 0.0
+    return prog
+
 def generate_word_report(hs_data_list, df_okr, df_rev, period):
     doc = Document()
     style = doc.styles['Normal']
@@ -273,6 +662,107 @@ def generate_word_report(hs_data_list, df_okr, df_rev, period):
     doc.save(bio)
     return bio
 
+# --- CHARTS (RENDER 1 LẦN -> PNG, CACHE THEO HASH DỮ LIỆU) ---
+
+def data_hash(*frames):
+    """Hash nội dung các DataFrame tổng hợp để làm khóa cache biểu đồ"""
+    h = hashlib.sha1()
+    for df in frames:
+        h.update("|".join(map(str, df.columns)).encode())
+        if not df.empty:
+            h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+def agg_progress_hist(df_okr):
+    """Phân bố tiến độ KR theo các khoảng 10%"""
+    if df_okr.empty: return pd.DataFrame(columns=['Khoang', 'SoKR'])
+    bins = list(range(0, 101, 10))
+    counts = pd.cut(df_okr['TienDo'].clip(0, 100), bins=bins, include_lowest=True).value_counts(sort=False)
+    return pd.DataFrame({'Khoang': [f"{b}-{b + 10}" for b in bins[:-1]], 'SoKR': counts.values})
+
+def agg_class_rates(df_users, counts):
+    """
+    Số HS nộp / duyệt OKR và tỉ lệ (%) theo lớp, dựa trên sĩ số GVCN khai báo.
+    Cột: Lop, GVCN, SiSo, DaNop, DaDuyet, Nop, Duyet - dùng cho cả bảng thống kê và biểu đồ.
+    """
+    gv = df_users[df_users['Role'] == 'GiaoVien']
+    lops = gv['Lop'].astype(str).tolist()
+    siso = gv['SiSo'].to_numpy(dtype=float)
+    sub = np.array([counts.get(l, (0, 0))[0] for l in lops], dtype=int)
+    app = np.array([counts.get(l, (0, 0))[1] for l in lops], dtype=int)
+    safe = np.where(siso > 0, siso, 1.0)
+    return pd.DataFrame({
+        'Lop': lops, 'GVCN': gv['HoTen'].tolist(), 'SiSo': gv['SiSo'].tolist(), 'DaNop': sub, 'DaDuyet': app,
+        'Nop': np.where(siso > 0, sub / safe * 100, 0.0), 'Duyet': np.where(siso > 0, app / safe * 100, 0.0)
+    })
+
+def agg_period_trend(df_okr, df_periods):
+    """Tiến độ trung bình qua các đợt (theo thứ tự sheet Periods)"""
+    means = df_okr.groupby('Dot')['TienDo'].mean()
+    order = [p for p in df_periods['TenDot'].tolist() if p in means.index] if not df_periods.empty else []
+    return pd.DataFrame({'Dot': order, 'TienDo': [float(means[p]) for p in order]})
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def render_chart(kind, key, _data, title=""):
+    """Vẽ biểu đồ ra PNG bytes. Cache theo (kind, key) - `_data` không được hash"""
+    fig = Figure(figsize=(7, 3.2), dpi=110)
+    ax = fig.subplots()
+    if kind == 'hist':
+        ax.bar(_data['Khoang'], _data['SoKR'], color="#4C9BE8")
+        ax.set_xlabel("Tiến độ (%)")
+        ax.set_ylabel("Số KR")
+        ax.tick_params(axis='x', labelsize=7)
+    elif kind == 'rates':
+        x = range(len(_data))
+        ax.bar([i - 0.2 for i in x], _data['Nop'], width=0.4, label="Đã nộp", color="#F5A623")
+        ax.bar([i + 0.2 for i in x], _data['Duyet'], width=0.4, label="Đã duyệt", color="#2EAD5B")
+        ax.set_xticks(list(x))
+        ax.set_xticklabels(_data['Lop'], rotation=45, ha='right', fontsize=7)
+        ax.set_ylabel("%")
+        ax.set_ylim(0, 100)
+        ax.legend(fontsize=7)
+    elif kind == 'trend':
+        ax.plot(_data['Dot'], _data['TienDo'], marker='o', color="#4C9BE8")
+        ax.set_ylabel("Tiến độ TB (%)")
+        ax.set_ylim(0, 100)
+        ax.tick_params(axis='x', labelsize=7)
+    ax.set_title(title, fontsize=10)
+    ax.grid(axis='y', alpha=0.3)
+    fig.tight_layout()
+    bio = BytesIO()
+    fig.savefig(bio, format='png')
+    return bio.getvalue()
+
+def show_chart(kind, data, title=""):
+    if data.empty:
+        st.caption(f"{title}: chưa có dữ liệu.")
+        return
+    st.image(render_chart(kind, data_hash(data), data, title), use_container_width=True)
+
+def search_ui(key, fixed_class=None):
+    """Ô tìm kiếm OKR / KR / nhận xét. fixed_class: GV chỉ tìm trong lớp của mình"""
+    df_users = load_data('Users')
+    df_p = load_data('Periods')
+    ensure_search_index(load_data('OKRs'), load_data('FinalReviews'), df_users)
+    c1, c2, c3, c4 = st.columns([3, 1.5, 1.5, 1.5])
+    q = c1.text_input("Từ khóa", placeholder="VD: IELTS, lo lắng...", key=f"{key}_q")
+    dot = c2.selectbox("Đợt", ["Tất cả"] + (df_p['TenDot'].tolist() if not df_p.empty else []), key=f"{key}_dot")
+    if fixed_class is None:
+        classes = sorted(df_users[df_users['Role'] == 'GiaoVien']['Lop'].astype(str).unique()) if not df_users.empty else []
+        lop = c3.selectbox("Lớp", ["Tất cả"] + classes, key=f"{key}_lop")
+    else:
+        lop = c3.selectbox("Lớp", [fixed_class], key=f"{key}_lop", disabled=True)
+    stt = c4.selectbox("Trạng thái", ["Tất cả", "Chờ duyệt", "Đã duyệt", "Cần sửa", "Chưa chốt", "Đã chốt"], key=f"{key}_stt")
+    if not q: return
+    t0 = time.perf_counter()
+    hits = search_index(q, None if dot == "Tất cả" else dot, None if lop == "Tất cả" else lop, None if stt == "Tất cả" else stt)
+    st.caption(f"{len(hits)} kết quả ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    if hits:
+        st.dataframe(pd.DataFrame([{
+            "Loại": h['meta']['Loai'], "Lớp": h['meta']['Lop'], "Email": h['meta']['Email'], "Đợt": h['meta']['Dot'],
+            "Trạng thái": h['meta']['TrangThai'], "Nội dung": " | ".join(t for t in h['texts'] if t)
+        } for h in hits]), use_container_width=True, hide_index=True)
+
 def sidebar_controller():
     with st.sidebar:
         try: st.image(LOGO_URL, width=80)
@@ -363,7 +853,7 @@ def login_ui():
 
 def admin_view(period, is_open):
     st.title("🛡️ Admin Dashboard")
-    t1, t2, t3 = st.tabs(["⚙️ Quản lý Đợt", "📊 Thống kê Lớp", "👨‍🏫 Giáo Viên"])
+    t1, t2, t3, t4 = st.tabs(["⚙️ Quản lý Đợt", "📊 Thống kê Lớp", "👨‍🏫 Giáo Viên", "🔎 Tìm kiếm"])
     with t1:
         st.subheader("Danh sách Đợt")
         with st.form("new_p"):
@@ -387,32 +877,33 @@ def admin_view(period, is_open):
                         df_periods.at[i, 'TrangThai'] = "Khóa" if stt=="Mở" else "Mở"
                         save_df('Periods', df_periods)
                         st.rerun()
+        with st.expander("🔄 Tính lại tiến độ (TienDo)"):
+            st.caption("Dùng khi sửa Mục tiêu số hoặc đổi công thức. Chỉ ghi lại các dòng có giá trị thay đổi.")
+            scope = st.radio("Phạm vi", [f"Đợt đang chọn ({period})", "Toàn bộ"], horizontal=True, label_visibility="collapsed")
+            if st.button("Tính lại", key="recompute_prog"):
+                n = recompute_progress(period if scope.startswith("Đợt") else None)
+                if n is not None:
+                    st.success(f"Đã cập nhật {n} dòng." if n else "Tiến độ đã khớp, không cần cập nhật.")
     with t2:
         st.subheader(f"Bảng Thống Kê Tiến Độ - {period}")
         df_users = load_data('Users')
         df_okr = load_data('OKRs')
         df_okr_period = df_okr[df_okr['Dot'] == period]
-        df_gv = df_users[df_users['Role'] == 'GiaoVien']
-        if df_gv.empty: st.warning("Chưa có dữ liệu Giáo viên.")
+        ensure_status_table(df_okr, load_data('FinalReviews'))
+        rates = agg_class_rates(df_users, class_status_counts(period))
+        if rates.empty: st.warning("Chưa có dữ liệu Giáo viên.")
         else:
-            stats_data = []
-            for _, gv in df_gv.iterrows():
-                lop = str(gv['Lop'])
-                gv_name = gv['HoTen']
-                try: siso = int(gv['SiSo'])
-                except: siso = 0
-                okrs_of_class = df_okr_period[df_okr_period['Lop'] == lop]
-                hs_submitted_count = okrs_of_class['Email'].nunique()
-                hs_approved_emails = okrs_of_class[okrs_of_class['TrangThai'] == 'Đã duyệt']['Email'].unique()
-                hs_approved_count = len(hs_approved_emails)
-                pct_submit = (hs_submitted_count / siso * 100) if siso > 0 else 0
-                pct_approve = (hs_approved_count / siso * 100) if siso > 0 else 0
-                stats_data.append({
-                    "Lớp": lop, "GVCN": gv_name, "Sĩ Số": siso,
-                    "Đã Nộp": f"{hs_submitted_count} ({pct_submit:.0f}%)",
-                    "Đã Duyệt": f"{hs_approved_count} ({pct_approve:.0f}%)"
-                })
-            st.dataframe(pd.DataFrame(stats_data), use_container_width=True, hide_index=True)
+            stats_data = pd.DataFrame({
+                "Lớp": rates['Lop'], "GVCN": rates['GVCN'], "Sĩ Số": rates['SiSo'],
+                "Đã Nộp": [f"{n} ({p:.0f}%)" for n, p in zip(rates['DaNop'], rates['Nop'])],
+                "Đã Duyệt": [f"{n} ({p:.0f}%)" for n, p in zip(rates['DaDuyet'], rates['Duyet'])]
+            })
+            st.dataframe(stats_data, use_container_width=True, hide_index=True)
+        st.markdown("#### 📈 Biểu đồ toàn trường")
+        show_chart('rates', rates, f"Tỉ lệ nộp / duyệt theo lớp - {period}")
+        c1, c2 = st.columns(2)
+        with c1: show_chart('hist', agg_progress_hist(df_okr_period), f"Phân bố tiến độ - {period}")
+        with c2: show_chart('trend', agg_period_trend(df_okr, load_data('Periods')), "Xu hướng tiến độ qua các đợt")
     with t3:
         df_gv = load_data('Users')
         df_gv = df_gv[df_gv['Role'] == 'GiaoVien']
@@ -452,6 +943,8 @@ def admin_view(period, is_open):
                     batch_append('Users', rows)
                     st.success("OK")
                     st.rerun()
+    with t4:
+        search_ui("admin_search")
 
 # =============================================================================
 # 5. TEACHER MODULE
@@ -470,7 +963,8 @@ def teacher_view(period, is_open):
     df_okr_class = df_okr[(df_okr['Lop'] == my_class) & (df_okr['Dot'] == period)]
     df_rev = load_data('FinalReviews')
     df_rev_class = df_rev[(df_rev['Dot'] == period)]
-    t_main, t_hs, t_report = st.tabs(["🚀 Duyệt & Đánh Giá (All-in-One)", "👥 Quản Lý Học Sinh", "🖨️ Báo Cáo"])
+    ensure_status_table(df_okr, df_rev)
+    t_main, t_hs, t_chart, t_search, t_report = st.tabs(["🚀 Duyệt & Đánh Giá (All-in-One)", "👥 Quản Lý Học Sinh", "📈 Biểu Đồ", "🔎 Tìm kiếm", "🖨️ Báo Cáo"])
 
     with t_main:
         if df_hs.empty: st.info("Lớp chưa có học sinh.")
@@ -481,25 +975,9 @@ def teacher_view(period, is_open):
                 name_hs = hs['HoTen']
                 hs_okrs = df_okr_class[df_okr_class['Email'] == email_hs]
                 hs_rev = df_rev_class[df_rev_class['Email'] == email_hs]
-                icon = "🔴"
-                status_text = "Chưa nộp"
-                if not hs_okrs.empty:
-                    total_okr = len(hs_okrs)
-                    approved = len(hs_okrs[hs_okrs['TrangThai'] == 'Đã duyệt'])
-                    if approved == total_okr:
-                        icon = "🟢"
-                        status_text = "Đã duyệt OKR"
-                    else:
-                        icon = "🟡"
-                        status_text = "Chờ duyệt OKR"
-                is_finalized = False
-                if not hs_rev.empty and hs_rev.iloc[0]['TrangThai_CuoiKy'] == 'Đã chốt':
-                    icon = "✅"
-                    status_text = "Đã chốt sổ"
-                    is_finalized = True
-                elif not hs_rev.empty:
-                    icon = "⏳"
-                    status_text = "Đang đánh giá"
+                icon, status_text = student_status(email_hs, period)
+                # Khóa sửa lấy từ chính dữ liệu dùng để ghi (không dùng bảng tổng hợp để tránh ghi đè sai)
+                is_finalized = not hs_rev.empty and hs_rev.iloc[0]['TrangThai_CuoiKy'] == 'Đã chốt'
                 with st.expander(f"{icon} {name_hs} ({status_text})"):
                     st.markdown("##### 1. Duyệt Mục Tiêu (OKR)")
                     if hs_okrs.empty: st.warning("Học sinh chưa tạo OKR.")
@@ -606,6 +1084,14 @@ def teacher_view(period, is_open):
                     st.success("OK")
                     st.rerun()
 
+    with t_chart:
+        c1, c2 = st.columns(2)
+        with c1: show_chart('hist', agg_progress_hist(df_okr_class), f"Phân bố tiến độ lớp {my_class} - {period}")
+        with c2: show_chart('trend', agg_period_trend(df_okr[df_okr['Lop'] == my_class], load_data('Periods')), f"Xu hướng tiến độ lớp {my_class}")
+
+    with t_search:
+        search_ui("gv_search", fixed_class=my_class)
+
     with t_report:
         c1, c2 = st.columns(2)
         with c1:
@@ -802,6 +1288,8 @@ def main():
     if not st.session_state.user:
         login_ui()
     else:
+        # Prefetch: cold render chỉ chờ sheet chậm nhất thay vì tổng 4 lần gọi API
+        prefetch_data(*VIEW_SHEETS.get(st.session_state.user['Role'], []))
         period, is_open = sidebar_controller()
         if not period:
             st.warning("Vui lòng liên hệ Admin tạo đợt.")
@@ -0,0 +1,346 @@
+"""
+LOAD TEST: mô phỏng nhiều phiên đồng thời (HS / GV / PH) chạy app.py qua Streamlit AppTest.
+
+Toàn bộ Google Sheets được thay bằng backend giả trong bộ nhớ (FakeSheets), có đếm số lần gọi API
+và tùy chọn độ trễ mạng giả lập. Mỗi phiên: đăng nhập qua login_ui -> thao tác theo vai trò
+(HS cập nhật tiến độ, GV phê duyệt, PH chấm sao) -> đo thời gian từng lần rerun.
+
+Chạy:
+    python loadtest.py --levels 1,5,10,25 --iterations 3 --latency-ms 150
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+import streamlit as st
+from streamlit import config as st_config
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PERIOD = "HocKy1_LoadTest"
+SHEETS_QUOTA_PER_MIN = 300  # Quota đọc mặc định của Sheets API / project
+# Các lệnh tính vào quota ĐỌC (lệnh ghi có quota riêng)
+READ_CALLS = {'open_by_key', 'worksheet', 'get_all_records', 'get_all_values', 'row_values', 'find'}
+
+# =============================================================================
+# 1. FAKE SHEETS BACKEND
+# =============================================================================
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+class FakeWorksheet:
+    def __init__(self, backend, title, header):
+        self.backend = backend
+        self.title = title
+        self.rows = [list(header)]
+
+    def _call(self, name):
+        self.backend.hit(f"{self.title}.{name}")
+
+    def get_all_records(self):
+        self._call('get_all_records')
+        with self.backend.lock:
+            header = self.rows[0] if self.rows else []
+            return [dict(zip(header, r + [""] * (len(header) - len(r)))) for r in self.rows[1:]]
+
+    def get_all_values(self, value_render_option=None, **kwargs):
+        self._call('get_all_values')
+        raw = str(value_render_option) == 'UNFORMATTED_VALUE'
+        with self.backend.lock:
+            width = max((len(r) for r in self.rows), default=0)  # gspread trả về khối chữ nhật
+            return [["" if v is None else (v if raw else str(v)) for v in r] + [""] * (width - len(r)) for r in self.rows]
+
+    def row_values(self, row):
+        self._call('row_values')
+        with self.backend.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def find(self, query, in_column=None):
+        self._call('find')
+        with self.backend.lock:
+            for i, r in enumerate(self.rows):
+                cols = [in_column - 1] if in_column else range(len(r))
+                for c in cols:
+                    if c < len(r) and str(r[c]) == str(query):
+                        return FakeCell(i + 1, c + 1, r[c])
+        return None
+
+    def update_cell(self, row, col, value):
+        self._call('update_cell')
+        with self.backend.lock:
+            r = self.rows[row - 1]
+            r.extend([""] * (col - len(r)))
+            r[col - 1] = value
+
+    def batch_update(self, data, **kwargs):
+        self._call('batch_update')
+        with self.backend.lock:
+            for item in data:
+                row, col = gspread.utils.a1_to_rowcol(item['range'].split(':')[0])
+                for dr, vals in enumerate(item['values']):
+                    r = self.rows[row - 1 + dr]
+                    r.extend([""] * (col - 1 + len(vals) - len(r)))
+                    for dc, v in enumerate(vals): r[col - 1 + dc] = v
+
+    def delete_rows(self, index):
+        self._call('delete_rows')
+        with self.backend.lock:
+            del self.rows[index - 1]
+
+    def clear(self):
+        self._call('clear')
+        with self.backend.lock:
+            self.rows = []
+
+    def update(self, values, *args, **kwargs):
+        self._call('update')
+        with self.backend.lock:
+            self.rows = [list(r) for r in values]
+
+    def append_row(self, row, value_input_option=None):
+        self._call('append_row')
+        with self.backend.lock:
+            self.rows.append(list(row))
+
+    def append_rows(self, rows, value_input_option=None):
+        self._call('append_rows')
+        with self.backend.lock:
+            self.rows.extend(list(r) for r in rows)
+
+class FakeSpreadsheet:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def worksheet(self, title):
+        self.backend.hit('worksheet')
+        ws = self.backend.sheets.get(title)
+        if ws is None: raise gspread.WorksheetNotFound(title)
+        return ws
+
+    def add_worksheet(self, title, rows=1000, cols=20):
+        self.backend.hit('add_worksheet')
+        ws = FakeWorksheet(self.backend, title, [])
+        ws.rows = []
+        self.backend.sheets[title] = ws
+        return ws
+
+class FakeSheets:
+    """Backend giả thread-safe: đếm số lần gọi API + độ trễ giả lập mỗi lần gọi"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.sheets = {}
+        self.calls = {}
+
+    def hit(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency: time.sleep(self.latency)
+
+    def total_calls(self):
+        with self.lock: return sum(self.calls.values())
+
+    def read_calls(self):
+        # Lệnh trên worksheet được đếm dạng '<sheet>.<lệnh>'
+        with self.lock: return sum(n for name, n in self.calls.items() if name.rsplit('.', 1)[-1] in READ_CALLS)
+
+    def reset_calls(self):
+        with self.lock: self.calls = {}
+
+    def open_by_key(self, key):
+        self.hit('open_by_key')
+        return FakeSpreadsheet(self)
+
+    def seed(self, schema, n_classes, n_students, n_krs):
+        """Tạo dữ liệu mẫu: mỗi lớp 1 GV, n_students HS (kèm PH), mỗi HS n_krs KR"""
+        for title, header in schema.items():
+            self.sheets[title] = FakeWorksheet(self, title, header)
+        accounts = {'GiaoVien': [], 'HocSinh': [], 'PhuHuynh': []}
+        self.sheets['Periods'].rows.append([PERIOD, "Mở"])
+        for c in range(n_classes):
+            lop = f"10A{c + 1}"
+            gv = f"gv{c + 1}@school.com"
+            self.sheets['Users'].rows.append([gv, "123", "GiaoVien", f"GV {lop}", lop, "", n_students])
+            accounts['GiaoVien'].append(gv)
+            for i in range(n_students):
+                hs, ph = f"hs{c + 1}_{i + 1}@school.com", f"ph{c + 1}_{i + 1}@school.com"
+                self.sheets['Users'].rows.append([hs, "123", "HocSinh", f"HS {c + 1}.{i + 1}", lop, ph, 0])
+                accounts['HocSinh'].append(hs)
+                accounts['PhuHuynh'].append(ph)
+                for k in range(n_krs):
+                    stt = "Đã duyệt" if k % 2 == 0 else "Chờ duyệt"
+                    self.sheets['OKRs'].rows.append([
+                        str(uuid.uuid4()), hs, lop, PERIOD, "Học tập tốt", f"KR {k + 1}",
+                        10, 0, "điểm", 0, stt, "FALSE", "", 0, ""
+                    ])
+        return accounts
+
+def install_fake_backend(backend):
+    """Thay gspread.authorize & credentials để app.py dùng backend giả"""
+    gspread.authorize = lambda creds: backend
+    ServiceAccountCredentials.from_json_keyfile_dict = classmethod(lambda cls, *a, **k: None)
+
+def _capture_runtime(runtime_cls):
+    runtime_cls._loadtest_shared = runtime_cls._instance
+
+def install_shared_runtime():
+    """
+    AppTest gán rồi xóa Runtime._instance / st.secrets toàn cục sau mỗi run nên không chạy song song được.
+    Giữ cố định 1 runtime + secrets cho mọi phiên (giống 1 server thật, cache dùng chung giữa các phiên).
+    """
+    new_secrets = Secrets()
+    new_secrets._secrets = {'gcp_service_account': {'type': 'service_account'}}
+    st.secrets = new_secrets
+    st_config.set_option("global.appTest", True)
+    AppTest.from_function(_capture_runtime, args=(Runtime,)).run()
+    Runtime.instance = classmethod(lambda cls: cls._loadtest_shared)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    # 1 ScriptCache dùng chung (như server thật); ast.parse không an toàn khi gọi song song
+    shared_cache, lock, orig = ScriptCache(), threading.Lock(), ScriptCache.get_bytecode
+    def get_bytecode(self, script_path):
+        with lock: return orig(shared_cache, script_path)
+    ScriptCache.get_bytecode = get_bytecode
+
+# =============================================================================
+# 2. SESSION DRIVER
+# =============================================================================
+
+def _buttons(at, prefix):
+    return [b for b in at.button if b.key and b.key.startswith(prefix)]
+
+def _timed_run(at, latencies):
+    t0 = time.perf_counter()
+    at.run()
+    latencies.append(time.perf_counter() - t0)
+    if at.exception: raise RuntimeError(at.exception[0].value)
+
+def run_session(role, email, iterations, timeout):
+    """1 phiên người dùng: đăng nhập + thao tác theo vai trò. Trả về (latencies, error)"""
+    latencies = []
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        _timed_run(at, latencies)
+
+        # Đăng nhập qua login_ui
+        at.text_input[0].input(email)
+        at.text_input[1].input("123")
+        next(b for b in at.button if b.label == "Đăng nhập").click()
+        _timed_run(at, latencies)
+        if not at.session_state.user: raise RuntimeError(f"Đăng nhập thất bại: {email}")
+
+        for _ in range(iterations):
+            if role == 'HocSinh':
+                inputs = [n for n in at.number_input if n.key and n.key.startswith('act_')]
+                if inputs:
+                    n = random.choice(inputs)
+                    n.set_value(round(random.uniform(0, 12), 2))
+                    next(b for b in _buttons(at, 'btn_up_') if b.key == f"btn_up_{n.key[4:]}").click()
+            elif role == 'GiaoVien':
+                btns = _buttons(at, 'app_')
+                if btns: btns[0].click()
+            elif role == 'PhuHuynh':
+                btns = _buttons(at, 'star_')
+                if btns: random.choice(btns).click()
+            _timed_run(at, latencies)
+        return latencies, None
+    except Exception as e:
+        return latencies, f"{role} {email}: {e}"
+
+# =============================================================================
+# 3. LOAD LEVELS & REPORT
+# =============================================================================
+
+def pick_sessions(accounts, n, mix):
+    roles = random.choices(list(mix), weights=list(mix.values()), k=n)
+    return [(r, random.choice(accounts[r])) for r in roles]
+
+def percentile(values, p):
+    if not values: return 0.0
+    if len(values) == 1: return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+def run_level(backend, accounts, concurrency, args, mix):
+    if not args.warm:
+        st.cache_data.clear()
+        st.cache_resource.clear()
+    backend.reset_calls()
+    sessions = pick_sessions(accounts, concurrency, mix)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(lambda s: run_session(s[0], s[1], args.iterations, args.timeout), sessions))
+    elapsed = time.perf_counter() - t0
+    latencies = [l for lat, _ in results for l in lat]
+    errors = [e for _, e in results if e]
+    calls, reads = backend.total_calls(), backend.read_calls()
+    return {
+        'conc': concurrency,
+        'reruns': len(latencies),
+        'errors': len(errors),
+        'thr': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'api_min': calls / elapsed * 60 if elapsed else 0.0,
+        'read_min': reads / elapsed * 60 if elapsed else 0.0,
+        'api_rerun': calls / len(latencies) if latencies else 0.0,
+        'first_error': errors[0] if errors else ""
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test app.py với nhiều phiên đồng thời")
+    ap.add_argument('--levels', default="1,5,10,25", help="Các mức đồng thời, VD: 1,5,10,25")
+    ap.add_argument('--iterations', type=int, default=3, help="Số thao tác mỗi phiên sau đăng nhập")
+    ap.add_argument('--latency-ms', type=float, default=0.0, help="Độ trễ giả lập mỗi lần gọi API")
+    ap.add_argument('--classes', type=int, default=5)
+    ap.add_argument('--students', type=int, default=30, help="Số HS mỗi lớp")
+    ap.add_argument('--krs', type=int, default=4, help="Số KR mỗi HS")
+    ap.add_argument('--mix', default="HocSinh:7,GiaoVien:1,PhuHuynh:2", help="Tỉ lệ vai trò")
+    ap.add_argument('--timeout', type=float, default=60.0, help="Timeout mỗi rerun (giây)")
+    ap.add_argument('--warm', action='store_true', help="Giữ cache giữa các mức (mặc định: cold)")
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--calls', action='store_true', help="In chi tiết số lần gọi theo từng API")
+    args = ap.parse_args()
+    logging.disable(logging.WARNING)  # AppTest bật log DEBUG của Streamlit
+
+    random.seed(args.seed)
+    mix = {k: float(v) for k, v in (p.split(':') for p in args.mix.split(','))}
+
+    # Lấy SCHEMA trực tiếp từ app.py (không import để tránh chạy Streamlit ngoài AppTest)
+    import ast
+    with open(APP_PATH, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    schema = next(ast.literal_eval(n.value) for n in tree.body
+                  if isinstance(n, ast.Assign) and getattr(n.targets[0], 'id', None) == 'SCHEMA')
+
+    backend = FakeSheets(latency=args.latency_ms / 1000.0)
+    accounts = backend.seed(schema, args.classes, args.students, args.krs)
+    install_fake_backend(backend)
+    install_shared_runtime()
+
+    print(f"{'conc':>5} {'reruns':>7} {'err':>4} {'rr/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'API/min':>9} {'Đọc/min':>9} {'API/rr':>7}")
+    for level in [int(x) for x in args.levels.split(',')]:
+        r = run_level(backend, accounts, level, args, mix)
+        flag = "  ⚠️ vượt quota đọc" if r['read_min'] > SHEETS_QUOTA_PER_MIN else ""
+        print(f"{r['conc']:>5} {r['reruns']:>7} {r['errors']:>4} {r['thr']:>7.2f} {r['p50']:>8.0f} "
+              f"{r['p95']:>8.0f} {r['p99']:>8.0f} {r['api_min']:>9.0f} {r['read_min']:>9.0f} {r['api_rerun']:>7.1f}{flag}")
+        if r['first_error']: print(f"      lỗi đầu tiên: {r['first_error']}")
+        if args.calls:
+            for name, n in sorted(backend.calls.items(), key=lambda x: -x[1]): print(f"      {name:<28} {n:>6}")
+
+if __name__ == "__main__":
+    main()